@@ -3,6 +3,14 @@ Flask API for image search using CLIP embeddings and Elasticsearch
 Endpoints:
 - POST /index: Index an image with rig_id
 - POST /search: Search for similar images
+
+Set SEARCH_SHARDS=N (N >= 1) to serve /search from an in-process index
+partitioned by product_id into N shards that are scored in parallel.
+The default (0) runs the search in Elasticsearch.
+Sharded mode needs a single process started with `python app.py`: the index
+is loaded there, and /index and /delete only update the copy held by the
+process that handles them. Under `flask run`, gunicorn or several workers
+/search returns an error instead of silently falling back to Elasticsearch.
 """
 
 from flask import Flask, request, jsonify
@@ -10,12 +18,21 @@ from flask_cors import CORS
 import base64
 import os
 import tempfile
+
+# With sharded search every shard thread runs its own matrix product, so
+# numpy's OpenBLAS gets one thread per shard instead of a pool per shard that
+# oversubscribes the cores. Must be set before numpy is imported.
+# (MKL/OMP are left alone, torch uses them for the CLIP model.)
+if int(os.environ.get("SEARCH_SHARDS", "0")) > 0:
+    os.environ.setdefault("OPENBLAS_NUM_THREADS", "1")
+
 import numpy as np
-from elasticsearch import Elasticsearch
+from elasticsearch import Elasticsearch, helpers
 import clip
 import torch
 from PIL import Image
 from datetime import datetime
+from sharded_search import ShardedVectorIndex
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
@@ -27,6 +44,9 @@ ES_URL = f"http://{ES_HOST}:{ES_PORT}"
 INDEX_NAME = "image_search_index"
 VECTOR_DIMENSION = 512
 MIN_COSINE_SIMILARITY = 0.7
+SEARCH_SIZE = 100
+SEARCH_SHARDS = int(os.environ.get("SEARCH_SHARDS", "0"))
+DEBUG = True
 
 # Initialize Elasticsearch client
 es = Elasticsearch(
@@ -42,6 +62,9 @@ print(f"Loading CLIP model on {device}...")
 model, preprocess = clip.load("ViT-B/32", device=device)
 print("CLIP model loaded successfully!")
 
+# In-process sharded index, only used when SEARCH_SHARDS > 0
+sharded_index = None
+
 
 def get_image_embedding(image_path):
     """
@@ -58,6 +81,25 @@ def get_image_embedding(image_path):
         raise Exception(f"Error processing image: {str(e)}")
 
 
+def load_sharded_index(num_shards):
+    """
+    Build the in-process sharded index from all documents in Elasticsearch
+    Returns: ShardedVectorIndex
+    """
+    index = ShardedVectorIndex(num_shards, dimension=VECTOR_DIMENSION)
+    doc_ids, product_ids, vectors = [], [], []
+    for hit in helpers.scan(es, index=INDEX_NAME, query={"query": {"match_all": {}}}):
+        doc_ids.append(hit['_id'])
+        product_ids.append(hit['_source']['product_id'])
+        vectors.append(hit['_source']['vector'])
+        if len(doc_ids) >= 10000:
+            index.add_many(doc_ids, product_ids, vectors)
+            doc_ids, product_ids, vectors = [], [], []
+    if doc_ids:
+        index.add_many(doc_ids, product_ids, vectors)
+    return index
+
+
 def decode_base64_image(base64_string, temp_dir=None):
     """
     Decode base64 string to image file
@@ -174,12 +216,17 @@ def index_image():
             
             # Index document in Elasticsearch
             # Use rig_id as document ID to allow updates
+            # Route by rig_id so all images of a rig land on the same shard
             result = es.index(
                 index=INDEX_NAME,
                 id=f"{rig_id}_{datetime.now().timestamp()}",
-                document=doc
+                document=doc,
+                routing=rig_id
             )
             
+            if sharded_index is not None:
+                sharded_index.add(result["_id"], rig_id, embedding)
+            
             return jsonify({
                 "success": True,
                 "message": "Image indexed successfully",
@@ -215,6 +262,17 @@ def search_images():
         "image": "base64_string"
     }
     """
+    if SEARCH_SHARDS > 0 and sharded_index is None:
+        message = (
+            f"Sharded search is enabled (SEARCH_SHARDS={SEARCH_SHARDS}) but the "
+            "in-process index is not loaded, start the API with `python app.py`"
+        )
+        print(f"❌ {message}")
+        return jsonify({
+            "success": False,
+            "message": message
+        }), 503
+    
     try:
         data = request.get_json()
         
@@ -254,50 +312,60 @@ def search_images():
                     "message": f"Invalid embedding dimension: {len(query_vector)}, expected {VECTOR_DIMENSION}"
                 }), 500
             
-            # Perform vector search in Elasticsearch
-            # Using script_score query for cosine similarity
-            # cosineSimilarity returns value from -1 to 1
-            search_query = {
-                "script_score": {
-                    "query": {"match_all": {}},
-                    "script": {
-                        "source": "cosineSimilarity(params.query_vector, 'vector') + 1.0",
-                        "params": {
-                            "query_vector": query_vector.tolist()
-                        }
-                    },
-                    "min_score": MIN_COSINE_SIMILARITY + 1.0  # +1 because cosineSimilarity returns -1 to 1, we add 1 to make it 0 to 2
-                }
-            }
-            
-            # Execute search
-            response = es.search(
-                index=INDEX_NAME,
-                body={
-                    "size": 100,  # Get top 100 results
-                    "query": search_query
+            if sharded_index is not None:
+                # Scatter the query to all in-process shards in parallel,
+                # each returns its top results and they are merged with a heap
+                hits = sharded_index.search(
+                    query_vector,
+                    k=SEARCH_SIZE,
+                    min_score=MIN_COSINE_SIMILARITY
+                )
+            else:
+                # Perform vector search in Elasticsearch
+                # Using script_score query for cosine similarity
+                # cosineSimilarity returns value from -1 to 1
+                search_query = {
+                    "script_score": {
+                        "query": {"match_all": {}},
+                        "script": {
+                            "source": "cosineSimilarity(params.query_vector, 'vector') + 1.0",
+                            "params": {
+                                "query_vector": query_vector.tolist()
+                            }
+                        },
+                        "min_score": MIN_COSINE_SIMILARITY + 1.0  # +1 because cosineSimilarity returns -1 to 1, we add 1 to make it 0 to 2
+                    }
                 }
-            )
+                
+                # Execute search
+                response = es.search(
+                    index=INDEX_NAME,
+                    body={
+                        "size": SEARCH_SIZE,  # Get top 100 results
+                        "query": search_query
+                    }
+                )
+                
+                # Calculate actual cosine similarity (subtract 1 from score)
+                # score = cosineSimilarity + 1.0, so cosineSimilarity = score - 1.0
+                hits = [
+                    (hit['_score'] - 1.0, hit['_id'], hit['_source']['product_id'])
+                    for hit in response['hits']['hits']
+                ]
             
             # Extract rig_ids from results
             rig_ids = []
             seen_rig_ids = set()
             
-            for hit in response['hits']['hits']:
-                # Calculate actual cosine similarity (subtract 1 from score)
-                # score = cosineSimilarity + 1.0, so cosineSimilarity = score - 1.0
-                cosine_score = hit['_score'] - 1.0
-                
+            for cosine_score, elasticsearch_id, rig_id in hits:
                 # Only include if similarity >= threshold
                 if cosine_score >= MIN_COSINE_SIMILARITY:
-                    rig_id = hit['_source']['product_id']
-                    
                     # Filter duplicates - keep only the highest similarity for each rig_id
                     if rig_id not in seen_rig_ids:
                         rig_ids.append({
                             "rig_id": rig_id,
                             "similarity": round(cosine_score, 4),
-                            "elasticsearch_id": hit['_id']
+                            "elasticsearch_id": elasticsearch_id
                         })
                         seen_rig_ids.add(rig_id)
                     else:
@@ -307,7 +375,7 @@ def search_images():
                                 rig_ids[i] = {
                                     "rig_id": rig_id,
                                     "similarity": round(cosine_score, 4),
-                                    "elasticsearch_id": hit['_id']
+                                    "elasticsearch_id": elasticsearch_id
                                 }
                                 break
             
@@ -404,12 +472,15 @@ def delete_images_by_rig_id():
         deleted_count = 0
         failed_count = 0
         errors = []
+        deleted_ids = []
         
         for hit in hits:
             try:
                 doc_id = hit['_id']
-                es.delete(index=INDEX_NAME, id=doc_id)
+                # Documents indexed with custom routing must be deleted with it
+                es.delete(index=INDEX_NAME, id=doc_id, routing=hit.get('_routing'))
                 deleted_count += 1
+                deleted_ids.append(doc_id)
                 print(f"✅ Deleted document {doc_id} (rig_id: {rig_id})")
             except Exception as e:
                 failed_count += 1
@@ -428,6 +499,10 @@ def delete_images_by_rig_id():
         if failed_count > 0:
             result["errors"] = errors
         
+        if sharded_index is not None:
+            # Only drop what Elasticsearch actually deleted so both stay in sync
+            sharded_index.remove_product(rig_id, doc_ids=deleted_ids)
+        
         print(f"📊 Deletion complete: {deleted_count} deleted, {failed_count} failed")
         
         return jsonify(result), 200
@@ -440,6 +515,11 @@ def delete_images_by_rig_id():
         }), 500
 
 
+if SEARCH_SHARDS > 0 and __name__ != '__main__':
+    print(f"⚠️  SEARCH_SHARDS={SEARCH_SHARDS} but app.py was imported, not run: the sharded "
+          "index is only loaded by `python app.py`, /search will return errors.")
+
+
 if __name__ == '__main__':
     # Check Elasticsearch connection
     print(f"Connecting to Elasticsearch at {ES_URL}...")
@@ -453,6 +533,14 @@ if __name__ == '__main__':
     if not es.indices.exists(index=INDEX_NAME):
         print(f"⚠️  Warning: Index '{INDEX_NAME}' does not exist.")
         print("Please run create_index.py first to create the index.")
+        if SEARCH_SHARDS > 0:
+            print("⚠️  Sharded search is enabled but nothing was loaded, /search will return errors.")
+    elif SEARCH_SHARDS > 0 and (not DEBUG or os.environ.get("WERKZEUG_RUN_MAIN") == "true"):
+        # In debug mode the reloader runs this block in a watcher process too,
+        # only the child process that serves requests needs the vectors
+        print(f"Loading vectors into {SEARCH_SHARDS} in-process search shards...")
+        sharded_index = load_sharded_index(SEARCH_SHARDS)
+        print(f"✅ Loaded {len(sharded_index)} vectors into {SEARCH_SHARDS} shards")
     
     print(f"\n🚀 Starting Flask API server...")
     print(f"📡 Endpoints:")
@@ -462,5 +550,5 @@ if __name__ == '__main__':
     print(f"   - POST /delete - Delete all documents by rig_id")
     print(f"\n🌐 Server running on http://54.79.147.183:5211")
     
-    app.run(host='0.0.0.0', port=5211, debug=True)
+    app.run(host='0.0.0.0', port=5211, debug=DEBUG)
 
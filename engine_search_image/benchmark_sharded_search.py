@@ -0,0 +1,213 @@
+"""
+Benchmark for the in-process sharded search (sharded_search.py)
+Fills the index with random 512-d vectors (1M by default) and measures
+/search-style query latency (top 100, min similarity) for several shard counts.
+
+Vectors are grouped in clusters of CLUSTER_SIZE around random centers and the
+queries are small perturbations of indexed vectors, so every query has about
+CLUSTER_SIZE matches above MIN_COSINE_SIMILARITY spread over all shards.
+That way each shard returns (close to) top-k hits and the heap merge is timed
+too, not only the matrix product.
+
+Sharded runs use one OpenBLAS thread per shard, like app.py with
+SEARCH_SHARDS > 0. As the baseline, 1 shard is also run in a subprocess with
+OpenBLAS on every core, i.e. a single matrix product using the whole machine.
+
+The run ends with a verdict: whether any shard count beat the best
+single-shard run on this machine.
+
+Usage:
+    python benchmark_sharded_search.py --vectors 1000000 --shards 1 2 4 8
+
+Recorded results (1M vectors, 20 queries):
+
+    1 CPU core -- no parallelism possible, sharding does not help:
+      shards    mean ms     p50 ms     p95 ms   hits    speedup
+      1 (mt)      209.6      210.1      223.9    100      0.93x
+           1      195.2      199.9      216.8    100      1.00x
+           2      200.7      201.7      221.3    100      0.97x
+           4      217.5      216.2      250.7    100      0.90x
+           8      205.3      205.1      215.8    100      0.95x
+
+    Multi-core host: not measured yet. Until a run shows N shards beating
+    "1 (mt)", leave SEARCH_SHARDS at 0 (Elasticsearch search).
+"""
+
+import os
+
+# Same setting as app.py in sharded mode, must be set before numpy is imported
+os.environ.setdefault("OPENBLAS_NUM_THREADS", "1")
+
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from sharded_search import ShardedVectorIndex, VECTOR_DIMENSION
+
+MIN_COSINE_SIMILARITY = 0.7
+SEARCH_SIZE = 100
+BATCH_SIZE = 100000
+IMAGES_PER_RIG = 5
+CLUSTER_SIZE = 1000
+# Per-dimension noise around a unit-length center: cosine between two
+# members is about 1 / (1 + 512 * NOISE^2) ~ 0.9
+NOISE = 0.015
+
+
+def build_index(num_shards, num_vectors, seed, num_samples):
+    """
+    Build a sharded index of clustered random vectors, IMAGES_PER_RIG images
+    per rig. Consecutive images belong to different clusters, so the matches
+    of a query are spread over many rigs and therefore over all shards.
+    Returns: (index, copy of the first num_samples indexed vectors)
+    """
+    index = ShardedVectorIndex(num_shards, dimension=VECTOR_DIMENSION)
+    rng = np.random.default_rng(seed)
+    num_clusters = max(1, num_vectors // CLUSTER_SIZE)
+    centers = rng.standard_normal((num_clusters, VECTOR_DIMENSION), dtype=np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+
+    samples = None
+    for start in range(0, num_vectors, BATCH_SIZE):
+        count = min(BATCH_SIZE, num_vectors - start)
+        clusters = np.arange(start, start + count) % num_clusters
+        vectors = centers[clusters] + NOISE * rng.standard_normal((count, VECTOR_DIMENSION), dtype=np.float32)
+        if samples is None:
+            samples = vectors[:num_samples].copy()
+        doc_ids = [f"doc_{i}" for i in range(start, start + count)]
+        product_ids = [f"rig_{i // IMAGES_PER_RIG}" for i in range(start, start + count)]
+        index.add_many(doc_ids, product_ids, vectors)
+    return index, samples
+
+
+def run_queries(index, queries, warmup):
+    """
+    Returns: (per-query latencies in milliseconds, per-query hit counts)
+    """
+    for query in queries[:warmup]:
+        index.search(query, k=SEARCH_SIZE, min_score=MIN_COSINE_SIMILARITY)
+
+    latencies = []
+    hit_counts = []
+    for query in queries[warmup:]:
+        start = time.perf_counter()
+        hits = index.search(query, k=SEARCH_SIZE, min_score=MIN_COSINE_SIMILARITY)
+        latencies.append((time.perf_counter() - start) * 1000)
+        hit_counts.append(len(hits))
+    return latencies, hit_counts
+
+
+def run_unpinned_baseline(args):
+    """
+    Run 1 shard in a subprocess with OpenBLAS using all cores
+    Returns: (mean, p50, p95) in milliseconds, mean hits per query
+    """
+    env = dict(os.environ, OPENBLAS_NUM_THREADS=str(os.cpu_count()))
+    command = [
+        sys.executable, os.path.abspath(__file__),
+        "--vectors", str(args.vectors),
+        "--shards", "1",
+        "--queries", str(args.queries),
+        "--warmup", str(args.warmup),
+        "--seed", str(args.seed),
+        "--no-baseline",
+        "--json"
+    ]
+    output = subprocess.run(command, env=env, capture_output=True, text=True, check=True)
+    return tuple(json.loads(output.stdout.splitlines()[-1])[0][1:])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sharded vector search")
+    parser.add_argument("--vectors", type=int, default=1000000, help="number of indexed vectors")
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8], help="shard counts to compare")
+    parser.add_argument("--queries", type=int, default=50, help="number of timed queries")
+    parser.add_argument("--warmup", type=int, default=5, help="number of untimed warmup queries")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--no-baseline", action="store_true", help="skip the 1-shard run with multithreaded BLAS")
+    parser.add_argument("--json", action="store_true", help="only print the results as JSON")
+    args = parser.parse_args()
+
+    if args.json:
+        sys.stdout = open(os.devnull, "w")
+
+    print("=" * 60)
+    print("Sharded Vector Search Benchmark")
+    print("=" * 60)
+    print(f"Vectors: {args.vectors:,} x {VECTOR_DIMENSION} (float32)")
+    print(f"Queries: {args.queries} (+{args.warmup} warmup), top {SEARCH_SIZE}")
+    print(f"CPU cores: {os.cpu_count()}")
+    print(f"OpenBLAS threads per shard: {os.environ['OPENBLAS_NUM_THREADS']}")
+    if max(args.shards) > os.cpu_count():
+        print(f"⚠️  More shards than CPU cores: shards above {os.cpu_count()} cannot run in parallel")
+    print("=" * 60)
+
+    baseline = None
+    if not args.no_baseline:
+        print(f"\n🔨 Baseline: 1 shard, OpenBLAS on {os.cpu_count()} threads (subprocess)...")
+        baseline = run_unpinned_baseline(args)
+        print(f"   mean {baseline[0]:.1f} ms, p50 {baseline[1]:.1f} ms, p95 {baseline[2]:.1f} ms, "
+              f"{baseline[3]:.0f} hits/query")
+
+    num_queries = args.queries + args.warmup
+    rng = np.random.default_rng(args.seed + 1)
+
+    results = []
+    for num_shards in args.shards:
+        print(f"\n🔨 Building index with {num_shards} shard(s)...")
+        start = time.perf_counter()
+        index, samples = build_index(num_shards, args.vectors, args.seed, num_queries)
+        print(f"   built {len(index):,} vectors in {time.perf_counter() - start:.1f}s")
+
+        # Same seed -> same index contents for every shard count, so the
+        # queries are built once from the first index and reused
+        if results == []:
+            queries = samples + NOISE * rng.standard_normal(samples.shape, dtype=np.float32)
+
+        latencies, hit_counts = run_queries(index, queries, args.warmup)
+        index.close()
+        del index
+
+        results.append((
+            num_shards,
+            float(np.mean(latencies)),
+            float(np.percentile(latencies, 50)),
+            float(np.percentile(latencies, 95)),
+            float(np.mean(hit_counts))
+        ))
+        print(f"   mean {results[-1][1]:.1f} ms, p50 {results[-1][2]:.1f} ms, p95 {results[-1][3]:.1f} ms, "
+              f"{results[-1][4]:.0f} hits/query")
+
+    if args.json:
+        sys.stdout.close()
+        sys.stdout = sys.__stdout__
+        print(json.dumps(results))
+        return
+
+    rows = [(str(num_shards), *numbers) for num_shards, *numbers in results]
+    if baseline is not None:
+        rows.insert(0, ("1 (mt)", *baseline))
+    # Speedup is relative to the fastest single-shard configuration
+    reference = min(row[1] for row in rows if row[0].startswith("1"))
+
+    print("\n" + "=" * 60)
+    print(f"{'shards':>8} {'mean ms':>10} {'p50 ms':>10} {'p95 ms':>10} {'hits':>6} {'speedup':>10}")
+    for name, mean, p50, p95, hits in rows:
+        print(f"{name:>8} {mean:>10.1f} {p50:>10.1f} {p95:>10.1f} {hits:>6.0f} {reference / mean:>9.2f}x")
+    print("(mt) = 1 shard with multithreaded OpenBLAS")
+    print("=" * 60)
+
+    best = min(rows, key=lambda row: row[1])
+    if best[0].startswith("1"):
+        print("❌ No shard count beat the best single-shard run on this machine,")
+        print("   keep SEARCH_SHARDS at 0 (Elasticsearch) or 1 here.")
+    else:
+        print(f"✅ {best[0]} shards: {reference / best[1]:.2f}x faster than the best single-shard run")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,9 +3,14 @@ Script to create Elasticsearch index for image search
 Index structure:
 - product_id: text/keyword field
 - vector: dense_vector with 512 dimensions (float array)
+
+Set NUMBER_OF_SHARDS to split the index across several shards. app.py routes
+documents by product_id, so every rig lives on a single shard and a search
+fans out to all shards in parallel.
 """
 
 from elasticsearch import Elasticsearch
+import os
 import sys
 
 # Elasticsearch connection
@@ -16,6 +21,7 @@ ES_URL = f"http://{ES_HOST}:{ES_PORT}"
 # Index configuration
 INDEX_NAME = "image_search_index"
 VECTOR_DIMENSION = 512
+NUMBER_OF_SHARDS = int(os.environ.get("NUMBER_OF_SHARDS", "1"))
 
 
 def create_elasticsearch_index():
@@ -63,7 +69,7 @@ def create_elasticsearch_index():
                 }
             },
             "settings": {
-                "number_of_shards": 1,
+                "number_of_shards": NUMBER_OF_SHARDS,
                 "number_of_replicas": 0
             }
         }
@@ -75,6 +81,7 @@ def create_elasticsearch_index():
         print(f"   - product_id: keyword")
         print(f"   - vector: dense_vector ({VECTOR_DIMENSION} dimensions)")
         print(f"   - similarity: cosine")
+        print(f"   - shards: {NUMBER_OF_SHARDS}")
         
         # Verify index was created
         if es.indices.exists(index=INDEX_NAME):
@@ -137,6 +144,7 @@ if __name__ == "__main__":
     print(f"Target: {ES_URL}")
     print(f"Index Name: {INDEX_NAME}")
     print(f"Vector Dimension: {VECTOR_DIMENSION}")
+    print(f"Shards: {NUMBER_OF_SHARDS}")
     print("=" * 60)
     print()
     
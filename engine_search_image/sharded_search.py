@@ -0,0 +1,356 @@
+"""
+In-process sharded vector index for image search
+Vectors are partitioned across N shards by hash of product_id.
+A query fans out to every shard in parallel, each shard returns its own
+top-k and the per-shard results are merged with a heap.
+"""
+
+import heapq
+import itertools
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+VECTOR_DIMENSION = 512
+INITIAL_SHARD_CAPACITY = 1024
+
+
+def shard_for_product(product_id, num_shards):
+    """
+    Stable shard number for a product_id
+    (crc32 instead of hash() so it is the same in every process)
+    """
+    return zlib.crc32(str(product_id).encode("utf-8")) % num_shards
+
+
+def normalize(vectors):
+    """
+    L2-normalize vectors so that dot product == cosine similarity
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class _Shard:
+    """
+    One partition of the index: a growable float32 matrix plus ids.
+    Deleted rows are only marked dead (tombstones) and skipped by search;
+    the shard is compacted once a quarter of its rows are dead.
+    """
+
+    def __init__(self, dimension):
+        self.dimension = dimension
+        self.lock = threading.Lock()
+        self.vectors = np.empty((INITIAL_SHARD_CAPACITY, dimension), dtype=np.float32)
+        self.alive = np.zeros(INITIAL_SHARD_CAPACITY, dtype=bool)
+        self.doc_ids = []
+        self.product_ids = []
+        self.rows_by_product = {}
+        self.size = 0
+        self.dead = 0
+
+    def __len__(self):
+        return self.size - self.dead
+
+    def _reserve(self, extra):
+        needed = self.size + extra
+        capacity = self.vectors.shape[0]
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        grown = np.empty((capacity, self.dimension), dtype=np.float32)
+        grown[:self.size] = self.vectors[:self.size]
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:self.size] = self.alive[:self.size]
+        self.vectors = grown
+        self.alive = alive
+
+    def _compact(self):
+        """
+        Drop dead rows. Builds new containers so in-flight searches keep
+        their snapshot.
+        """
+        keep = np.flatnonzero(self.alive[:self.size])
+        capacity = INITIAL_SHARD_CAPACITY
+        while capacity < len(keep):
+            capacity *= 2
+        vectors = np.empty((capacity, self.dimension), dtype=np.float32)
+        vectors[:len(keep)] = self.vectors[keep]
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:len(keep)] = True
+        doc_ids = [self.doc_ids[i] for i in keep]
+        product_ids = [self.product_ids[i] for i in keep]
+        rows_by_product = {}
+        for row, product_id in enumerate(product_ids):
+            rows_by_product.setdefault(product_id, []).append(row)
+
+        self.vectors, self.alive = vectors, alive
+        self.doc_ids, self.product_ids = doc_ids, product_ids
+        self.rows_by_product = rows_by_product
+        self.size = len(keep)
+        self.dead = 0
+
+    def add(self, doc_ids, product_ids, vectors):
+        with self.lock:
+            self._reserve(len(doc_ids))
+            start = self.size
+            self.vectors[start:start + len(doc_ids)] = vectors
+            self.alive[start:start + len(doc_ids)] = True
+            self.doc_ids.extend(doc_ids)
+            self.product_ids.extend(product_ids)
+            for row, product_id in enumerate(product_ids, start):
+                self.rows_by_product.setdefault(product_id, []).append(row)
+            self.size += len(doc_ids)
+
+    def remove_product(self, product_id, doc_ids=None):
+        with self.lock:
+            rows = self.rows_by_product.get(product_id, [])
+            if doc_ids is None:
+                removed, kept = rows, []
+            else:
+                removed = [row for row in rows if self.doc_ids[row] in doc_ids]
+                kept = [row for row in rows if self.doc_ids[row] not in doc_ids]
+            if not removed:
+                return 0
+
+            self.alive[removed] = False
+            self.dead += len(removed)
+            if kept:
+                self.rows_by_product[product_id] = kept
+            else:
+                del self.rows_by_product[product_id]
+
+            if self.dead * 4 >= self.size:
+                self._compact()
+            return len(removed)
+
+    def search(self, query_vector, k, min_score):
+        """
+        Top-k of this shard as a list of (score, doc_id, product_id),
+        sorted by score descending
+        """
+        with self.lock:
+            vectors, alive, doc_ids, product_ids, size, dead = (
+                self.vectors, self.alive, self.doc_ids, self.product_ids,
+                self.size, self.dead
+            )
+        if size == dead:
+            return []
+
+        scores = vectors[:size] @ query_vector
+        if dead:
+            scores[~alive[:size]] = -np.inf
+        if size > k:
+            top = np.argpartition(scores, size - k)[size - k:]
+        else:
+            top = np.arange(size)
+        top = top[np.argsort(scores[top])[::-1]]
+
+        results = []
+        for i in top:
+            score = float(scores[i])
+            if score == -np.inf or (min_score is not None and score < min_score):
+                break
+            results.append((score, doc_ids[i], product_ids[i]))
+        return results
+
+
+class ShardedVectorIndex:
+    """
+    Vector index partitioned by hash of product_id across num_shards shards.
+    Shards are scored in parallel by a thread pool: the numpy matrix product
+    and argpartition release the GIL, so shards can be scored on separate
+    cores at the same time. Whether that lowers latency depends on the cores
+    and memory bandwidth, measure with benchmark_sharded_search.py.
+    """
+
+    def __init__(self, num_shards, dimension=VECTOR_DIMENSION):
+        if num_shards < 1:
+            raise ValueError(f"num_shards must be >= 1, got {num_shards}")
+        self.num_shards = num_shards
+        self.dimension = dimension
+        self.shards = [_Shard(dimension) for _ in range(num_shards)]
+        self.executor = ThreadPoolExecutor(
+            max_workers=num_shards,
+            thread_name_prefix="search-shard"
+        )
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards)
+
+    def add(self, doc_id, product_id, vector):
+        """
+        Add a single vector
+        """
+        self.add_many([doc_id], [product_id], [vector])
+
+    def add_many(self, doc_ids, product_ids, vectors):
+        """
+        Add a batch of vectors, routing each one to its product_id's shard
+        """
+        vectors = normalize(vectors).reshape(-1, self.dimension)
+        if not (len(doc_ids) == len(product_ids) == len(vectors)):
+            raise ValueError("doc_ids, product_ids and vectors must have the same length")
+
+        product_ids = [str(pid) for pid in product_ids]
+        shard_numbers = np.array(
+            [shard_for_product(pid, self.num_shards) for pid in product_ids],
+            dtype=np.int64
+        )
+        for shard_number, shard in enumerate(self.shards):
+            rows = np.flatnonzero(shard_numbers == shard_number)
+            if len(rows) == 0:
+                continue
+            shard.add(
+                [doc_ids[i] for i in rows],
+                [product_ids[i] for i in rows],
+                vectors[rows]
+            )
+
+    def remove_product(self, product_id, doc_ids=None):
+        """
+        Remove the vectors of a product_id, only those in doc_ids if given
+        Returns: number of vectors removed
+        """
+        product_id = str(product_id)
+        if doc_ids is not None:
+            doc_ids = set(doc_ids)
+        shard = self.shards[shard_for_product(product_id, self.num_shards)]
+        return shard.remove_product(product_id, doc_ids)
+
+    def search(self, query_vector, k=100, min_score=None):
+        """
+        Scatter the query to all shards, gather each shard's top-k and
+        merge them with a heap
+        Returns: list of (cosine_similarity, doc_id, product_id), best first
+        """
+        query_vector = normalize(query_vector).reshape(self.dimension)
+        futures = [
+            self.executor.submit(shard.search, query_vector, k, min_score)
+            for shard in self.shards
+        ]
+        per_shard = [future.result() for future in futures]
+        merged = heapq.merge(*per_shard, key=lambda hit: hit[0], reverse=True)
+        return list(itertools.islice(merged, k))
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+def _brute_force(vectors, doc_ids, product_ids, query_vector, k, min_score):
+    """
+    Reference top-k by scoring every vector, for the self-check
+    """
+    scores = normalize(vectors) @ normalize(query_vector)
+    order = np.argsort(-scores, kind="stable")[:k]
+    return [
+        (float(scores[i]), doc_ids[i], product_ids[i])
+        for i in order
+        if min_score is None or scores[i] >= min_score
+    ]
+
+
+def _check_same_hits(actual, expected, label):
+    actual_ids = [hit[1] for hit in actual]
+    expected_ids = [hit[1] for hit in expected]
+    if actual_ids != expected_ids:
+        # Ties may come back in a different order, the scores must still match
+        actual_scores = np.array([hit[0] for hit in actual])
+        expected_scores = np.array([hit[0] for hit in expected])
+        if len(actual) != len(expected) or not np.allclose(actual_scores, expected_scores, atol=1e-5):
+            raise AssertionError(f"{label}: {actual_ids[:5]}... != {expected_ids[:5]}...")
+
+
+def _self_check():
+    """
+    Compare search with brute force for several shard counts and check
+    remove_product with and without doc_ids, including compaction
+    """
+    rng = np.random.default_rng(0)
+    num_vectors, dimension = 3000, 64
+    vectors = rng.standard_normal((num_vectors, dimension), dtype=np.float32)
+    doc_ids = [f"doc_{i}" for i in range(num_vectors)]
+    product_ids = [f"rig_{i // 3}" for i in range(num_vectors)]
+    queries = vectors[:20] + 0.3 * rng.standard_normal((20, dimension), dtype=np.float32)
+
+    for num_shards in (1, 3, 8):
+        index = ShardedVectorIndex(num_shards, dimension=dimension)
+        index.add_many(doc_ids[:2000], product_ids[:2000], vectors[:2000])
+        for i in range(2000, num_vectors):
+            index.add(doc_ids[i], product_ids[i], vectors[i])
+        assert len(index) == num_vectors
+
+        for k, min_score in ((1, None), (10, None), (100, 0.5), (num_vectors + 5, None)):
+            for query in queries:
+                _check_same_hits(
+                    index.search(query, k=k, min_score=min_score),
+                    _brute_force(vectors, doc_ids, product_ids, query, k, min_score),
+                    f"{num_shards} shards, k={k}, min_score={min_score}"
+                )
+
+        # Partial removal: only the listed doc_ids of the rig go away
+        assert index.remove_product("rig_0", doc_ids=["doc_0", "doc_1", "doc_5"]) == 2
+        assert index.remove_product("rig_0", doc_ids=[]) == 0
+        assert index.remove_product("rig_missing") == 0
+        hits = {hit[1] for hit in index.search(vectors[2], k=num_vectors)}
+        assert "doc_0" not in hits and "doc_1" not in hits and "doc_2" in hits
+
+        # Whole-rig removal, then enough removals to trigger compaction
+        assert index.remove_product("rig_0") == 1
+        removed_rigs = {f"rig_{i}" for i in range(1, 400)}
+        for product_id in removed_rigs:
+            assert index.remove_product(product_id) == 3
+        assert len(index) == num_vectors - 3 * 400
+        assert all(shard.dead * 4 < max(shard.size, 1) for shard in index.shards)
+
+        alive = [i for i in range(num_vectors) if product_ids[i] not in removed_rigs | {"rig_0"}]
+        for query in queries:
+            _check_same_hits(
+                index.search(query, k=50),
+                _brute_force(vectors[alive], [doc_ids[i] for i in alive],
+                             [product_ids[i] for i in alive], query, 50, None),
+                f"{num_shards} shards after removals"
+            )
+
+        # Re-adding a removed rig makes it searchable again
+        index.add("doc_again", "rig_0", vectors[0])
+        assert index.search(vectors[0], k=1)[0][1] == "doc_again"
+        index.close()
+        print(f"✅ {num_shards} shard(s): search matches brute force, removals OK")
+
+    # Concurrent add/remove/search: every returned hit must carry its own score
+    index = ShardedVectorIndex(4, dimension=dimension)
+    index.add_many(doc_ids, product_ids, vectors)
+    by_doc = dict(zip(doc_ids, normalize(vectors)))
+    by_doc["extra"] = normalize(vectors[0])
+    errors = []
+
+    def writer():
+        for i in range(num_vectors // 3):
+            index.remove_product(f"rig_{i}")
+            index.add("extra", f"rig_{i}", vectors[0])
+
+    def reader():
+        for query in queries:
+            for score, doc_id, _ in index.search(query, k=20):
+                expected = float(by_doc[doc_id] @ normalize(query))
+                if abs(score - expected) > 1e-4:
+                    errors.append(doc_id)
+
+    threads = [threading.Thread(target=writer)] + [threading.Thread(target=reader) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    index.close()
+    assert not errors, f"mismatched hits under concurrent updates: {errors[:5]}"
+    print("✅ concurrent add/remove/search returned consistent hits")
+
+
+if __name__ == "__main__":
+    _self_check()